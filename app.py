@@ -3,11 +3,16 @@ import json
 import os
 import threading
 import signal
+import multiprocessing
 import sys
 import atexit
 from queue import Queue, Empty
 from dotenv import load_dotenv
-from bot_logic import auto_reply, get_channel_info, get_bot_info, get_message_cache_info, refresh_message_cache
+from bot_logic import auto_reply, get_channel_info, get_bot_info, get_message_cache_info, refresh_message_cache, resize_connection_pools
+from connections import get_connection_stats, merge_connection_stats
+from tracing import get_trace, merge_traces, profile_thread, MAX_PROFILE_SECONDS
+import settings_store
+from sharding import ShardCoordinator
 from concurrent.futures import ThreadPoolExecutor
 import functools
 import logging
@@ -23,7 +28,12 @@ log.setLevel(logging.ERROR)
 CONFIG_FILE = 'config.json'
 active_threads = {}
 log_queue = Queue()
-executor = ThreadPoolExecutor(max_workers=5)  # Limit concurrent operations
+EXECUTOR_WORKERS = 5
+executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS)  # Limit concurrent operations
+
+# Optional multi-process mode: tasks are sharded across worker processes by channel ID
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '0') or 0)
+coordinator = None
 
 # Shutdown flag
 shutdown_flag = False
@@ -40,6 +50,10 @@ def cleanup():
         if hasattr(thread, 'stop_event'):
             thread.stop_event.set()
 
+    # Stop worker processes
+    if coordinator:
+        coordinator.shutdown()
+
     # Shutdown executor
     executor.shutdown(wait=False)
 
@@ -50,21 +64,59 @@ def signal_handler(sig, frame):
     cleanup()
     sys.exit(0)
 
-# Register signal handlers
-signal.signal(signal.SIGINT, signal_handler)  # Ctrl+C
-signal.signal(signal.SIGTERM, signal_handler)  # Termination signal
+# Worker processes re-import this module; only the panel process owns shutdown
+if multiprocessing.current_process().name == 'MainProcess':
+    # Register signal handlers
+    signal.signal(signal.SIGINT, signal_handler)  # Ctrl+C
+    signal.signal(signal.SIGTERM, signal_handler)  # Termination signal
+
+    # Register cleanup on exit
+    atexit.register(cleanup)
+
+def update_connection_pools():
+    """Resize per-host HTTP pools to match the number of running tasks"""
+    current = threading.current_thread()
+    running = sum(1 for thread in list(active_threads.values())
+                  if thread.is_alive() and thread is not current)
+    return resize_connection_pools(running, EXECUTOR_WORKERS)
+
+def run_task(*args):
+    """Thread target for a task; gives its pool share back when it exits on its own"""
+    try:
+        auto_reply(*args)
+    finally:
+        update_connection_pools()
+
+update_connection_pools()
+
+def is_task_running(task_id):
+    if coordinator:
+        return coordinator.is_running(task_id)
+    return task_id in active_threads and active_threads[task_id].is_alive()
 
-# Register cleanup on exit
-atexit.register(cleanup)
+def get_task_settings_version(task_id):
+    if coordinator:
+        return coordinator.get_settings_version(task_id)
+    return settings_store.get_applied_version(task_id)
+
+def publish_settings(config):
+    """Publish a settings snapshot locally and to worker processes"""
+    version = settings_store.publish(config)
+    if coordinator:
+        coordinator.publish_config(config, version)
+    return version
 
 def load_config():
+    config = create_default_config()
     if os.path.exists(CONFIG_FILE):
         with open(CONFIG_FILE, 'r') as f:
             try:
-                return json.load(f)
+                config = json.load(f)
             except json.JSONDecodeError:
-                return create_default_config()
-    return create_default_config()
+                pass
+    # Keep running tasks in sync with the file, also when edited by hand
+    publish_settings(config)
+    return config
 
 def create_default_config():
     return {
@@ -77,6 +129,8 @@ def create_default_config():
 def save_config(config):
     with open(CONFIG_FILE, 'w') as f:
         json.dump(config, f, indent=4)
+    # Running tasks pick up the new snapshot at their next cycle
+    return publish_settings(config)
 
 @functools.lru_cache(maxsize=32)
 def get_bot_info_cached(token):
@@ -139,11 +193,14 @@ def index():
             task["server_name"] = server
             task["channel_name"] = channel
         
-        task["status"] = ("Running" if task.get("id") in active_threads
-                          and active_threads[task.get("id")].is_alive() else "Stopped")
+        task["status"] = "Running" if is_task_running(task.get("id")) else "Stopped"
+        task["settings_version"] = get_task_settings_version(task.get("id"))
+        task["worker"] = coordinator.get_worker(task.get("id")) if coordinator else None
 
     pesan_info = get_message_cache_info()
-    return render_template('index.html', config=config, bot_accounts=bot_accounts, pesan_info=pesan_info)
+    shard_info = coordinator.get_overview() if coordinator else None
+    return render_template('index.html', config=config, bot_accounts=bot_accounts, pesan_info=pesan_info,
+                           shard_info=shard_info)
 
 @app.route('/logs')
 def logs():
@@ -161,8 +218,22 @@ def handle_refresh_pesan():
 @app.route('/save_config', methods=['POST'])
 def handle_save_config():
     new_config = request.json
-    save_config(new_config)
-    return jsonify({"status": "success", "message": "Perubahan disimpan!"})
+    version = save_config(new_config)
+    return jsonify({"status": "success", "message": "Perubahan disimpan!", "settings_version": version})
+
+@app.route('/task_status')
+def task_status():
+    """Running state and applied settings version for each task"""
+    statuses = {}
+    task_ids = coordinator.get_overview()["placement"] if coordinator else list(active_threads)
+    for task_id in task_ids:
+        statuses[task_id] = {
+            "status": "Running" if is_task_running(task_id) else "Stopped",
+            "settings_version": get_task_settings_version(task_id),
+        }
+        if coordinator:
+            statuses[task_id]["worker"] = coordinator.get_worker(task_id)
+    return jsonify({"settings_version": settings_store.get_version(), "tasks": statuses})
 
 @app.route('/start_bot', methods=['POST'])
 def start_bot():
@@ -175,7 +246,7 @@ def start_bot():
     if not task_to_run:
         return jsonify({"status": "error", "message": "Tugas tidak ditemukan."}), 404
 
-    if task_id in active_threads and active_threads[task_id].is_alive():
+    if is_task_running(task_id):
         return jsonify({"status": "warning", "message": "Tugas ini sudah berjalan."})
 
     token_index = task_to_run.get("assigned_token_index", 0)
@@ -194,13 +265,22 @@ def start_bot():
     google_keys = config['google_api_keys']
     agentrouter_keys = config.get('agentrouter_api_keys', [])
 
+    if coordinator:
+        worker_id = coordinator.start_task(task_id, channel_id, task_to_run, token, google_keys, agentrouter_keys)
+        if worker_id is None:
+            return jsonify({"status": "error", "message": "Tidak ada worker process yang tersedia."}), 503
+        log_queue.put(f"✅ [{channel_id}] Tugas '{task_id}' dimulai di worker W{worker_id} dengan akun: {username}.")
+        return jsonify({"status": "success", "message": "Tugas berhasil dimulai."})
+
     stop_event = threading.Event()
-    thread = threading.Thread(target=auto_reply, args=(
-        channel_id, task_to_run, token, google_keys, log_queue, stop_event, agentrouter_keys), daemon=True)
+    thread = threading.Thread(target=run_task, args=(
+        channel_id, task_to_run, token, google_keys, log_queue, stop_event, agentrouter_keys, task_id),
+        name=f"task-{task_id}", daemon=True)
 
     active_threads[task_id] = thread
     active_threads[task_id].stop_event = stop_event
     thread.start()
+    update_connection_pools()
 
     log_queue.put(f"✅ [{channel_id}] Tugas '{task_id}' dimulai dengan akun: {username}.")
     return jsonify({"status": "success", "message": "Tugas berhasil dimulai."})
@@ -210,18 +290,85 @@ def stop_bot():
     data = request.json
     task_id = data.get('task_id')
 
+    if coordinator:
+        if coordinator.stop_task(task_id):
+            log_queue.put(f"🛑 Tugas '{task_id}' berhasil dihentikan.")
+            return jsonify({"status": "success", "message": "Tugas dihentikan."})
+        return jsonify({"status": "error", "message": "Tugas tidak sedang berjalan."}), 404
+
     if task_id in active_threads and active_threads[task_id].is_alive():
         active_threads[task_id].stop_event.set()
         del active_threads[task_id]
+        update_connection_pools()
         log_queue.put(f"🛑 Tugas '{task_id}' berhasil dihentikan.")
         return jsonify({"status": "success", "message": "Tugas dihentikan."})
 
     return jsonify({"status": "error", "message": "Tugas tidak sedang berjalan."}), 404
 
+@app.route('/workers')
+def workers():
+    """Worker process placement, load and rebalance events"""
+    if not coordinator:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **coordinator.get_overview()})
+
+@app.route('/connection_stats')
+def connection_stats():
+    """Per-host connection pool sizes and new/reused/exhausted counters"""
+    if coordinator:
+        # Bot traffic runs in the workers; add their last reported stats to the panel's
+        return jsonify(merge_connection_stats([get_connection_stats()] + coordinator.get_connection_stats()))
+    return jsonify(get_connection_stats())
+
+@app.route('/trace')
+def trace():
+    """Export recorded tracing spans as Chrome/Perfetto trace JSON"""
+    clear = request.args.get('clear') in ('1', 'true')
+    trace_data = get_trace(clear=clear)
+    if coordinator:
+        trace_data = merge_traces([trace_data] + coordinator.collect_traces(clear=clear))
+    response = jsonify(trace_data)
+    response.headers['Content-Disposition'] = 'attachment; filename=trace.json'
+    return response
+
+@app.route('/profile', methods=['POST'])
+def profile():
+    """Attach a sampling profiler to a running task and return collapsed stacks"""
+    data = request.json or {}
+    task_id = data.get('task_id')
+    seconds = data.get('seconds', 10)
+
+    thread = None if coordinator else active_threads.get(task_id)
+    if not is_task_running(task_id):
+        return jsonify({"status": "error", "message": "Tugas tidak sedang berjalan."}), 404
+
+    try:
+        seconds = max(0.1, min(float(seconds), MAX_PROFILE_SECONDS))
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Durasi profil tidak valid."}), 400
+
+    log_queue.put(f"🔬 Profiling tugas '{task_id}' selama {seconds:g} detik...")
+    if coordinator:
+        # The task thread lives in a worker process; it samples and sends the stacks back
+        collapsed = coordinator.profile_task(task_id, seconds)
+        if collapsed is None:
+            return jsonify({"status": "error", "message": "Tugas tidak sedang berjalan."}), 404
+    else:
+        collapsed = profile_thread(thread.ident, seconds)
+    response = Response(collapsed, mimetype='text/plain')
+    response.headers['Content-Disposition'] = f'attachment; filename=profile-{task_id}.folded'
+    return response
+
 if __name__ == '__main__':
     print("🚀 Starting Discord Bot Dashboard on http://localhost:5005")
     print("⚠️  Press Ctrl+C to stop the server")
 
+    if WORKER_PROCESSES > 0:
+        coordinator = ShardCoordinator(WORKER_PROCESSES, log_queue)
+        coordinator.start()
+        load_config()  # Sends the initial settings snapshot to the workers
+        print(f"🧩 Running bot tasks in {WORKER_PROCESSES} worker processes")
+
     try:
         # Run Flask without reloader to prevent duplicate processes
         # use_reloader=False ensures app closes when terminal is closed
@@ -3,8 +3,10 @@ import requests
 import random
 import threading
 from datetime import datetime
-from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from connections import HostPoolAdapter, configure_pools
+from tracing import span
+from settings_store import get_task_settings, mark_applied, clear_applied
 
 processed_message_ids = set()
 used_api_keys = set()
@@ -17,18 +19,23 @@ _message_cache = None
 _message_cache_time = 0
 MESSAGE_CACHE_TTL = 300  # 5 minutes
 
-# Create a session with connection pooling and retry strategy
+# Create a session with per-host connection pools and retry strategy
 session = requests.Session()
 retry_strategy = Retry(
     total=3,
     status_forcelist=[429, 500, 502, 503, 504],
     backoff_factor=1
 )
-adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=10, pool_maxsize=20)
+adapter = HostPoolAdapter(max_retries=retry_strategy, pool_connections=10, pool_maxsize=20)
 session.mount("http://", adapter)
 session.mount("https://", adapter)
 
 
+def resize_connection_pools(active_tasks, workers):
+    """Size the Discord/Gemini/AgentRouter pools for the current load."""
+    return configure_pools(adapter, active_tasks, workers)
+
+
 def log_message(queue, message, level="INFO"):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     icon_map = {
@@ -130,7 +137,9 @@ def generate_reply_agentrouter(prompt, prompt_language, agentrouter_api_key, mod
     }
 
     try:
-        response = session.post(url, headers=headers, json=data, timeout=30)
+        with span("agentrouter.chat_completions", "http", model=model_id) as trace_args:
+            response = session.post(url, headers=headers, json=data, timeout=30)
+            trace_args["status"] = response.status_code
 
         if response.status_code == 429:
             log_message(queue, f"⚠️ AgentRouter rate limit (429)", "WARNING")
@@ -172,7 +181,8 @@ def generate_reply(prompt, prompt_language, use_google_ai, google_api_keys, queu
             log_message(queue, "Tidak ada Google API Key.", "ERROR")
             return None
 
-        google_api_key = get_random_api_key(google_api_keys, queue)
+        with span("get_random_api_key"):
+            google_api_key = get_random_api_key(google_api_keys, queue)
 
         if prompt_language == "id":
             ai_prompt = f"Balas pesan berikut dalam Bahasa Indonesia: '{prompt}'. Buat balasan menjadi satu kalimat santai dan kasual tanpa simbol seperti yang diucapkan manusia sehari-hari."
@@ -187,10 +197,11 @@ def generate_reply(prompt, prompt_language, use_google_ai, google_api_keys, queu
             # Use latest stable model
             model_id = "gemini-2.5-flash-lite"
             try:
-                sdk_response = client.models.generate_content(
-                    model=model_id,
-                    contents=ai_prompt,
-                )
+                with span("gemini.sdk_generate_content", "http", model=model_id):
+                    sdk_response = client.models.generate_content(
+                        model=model_id,
+                        contents=ai_prompt,
+                    )
                 generated_text = (getattr(sdk_response, "text", None) or "").strip()
                 if generated_text:
                     if generated_text.lower() == last_generated_text:
@@ -221,7 +232,9 @@ def generate_reply(prompt, prompt_language, use_google_ai, google_api_keys, queu
             # Use query parameter for API key instead of header (more compatible)
             url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_id}:generateContent?key={google_api_key}"
             try:
-                response = session.post(url, headers=headers, json=data, timeout=20)
+                with span("gemini.rest_generate_content", "http", model=model_id) as trace_args:
+                    response = session.post(url, headers=headers, json=data, timeout=20)
+                    trace_args["status"] = response.status_code
 
                 if response.status_code == 404:
                     log_message(queue, f"⚠️ Model {model_id} not found (404), trying next model...", "WARNING")
@@ -288,7 +301,9 @@ def send_message(
         payload["message_reference"] = {"message_id": reply_to}
     url = f"https://discord.com/api/v9/channels/{channel_id}/messages"
     try:
-        response = session.post(url, json=payload, headers=headers)
+        with span("discord.send_message", "http", channel_id=channel_id) as trace_args:
+            response = session.post(url, json=payload, headers=headers)
+            trace_args["status"] = response.status_code
         response.raise_for_status()
         data = response.json()
         message_id = data.get("id")
@@ -316,7 +331,9 @@ def delete_message(channel_id, message_id, token, queue):
     headers = {"Authorization": token}
     url = f"https://discord.com/api/v9/channels/{channel_id}/messages/{message_id}"
     try:
-        response = session.delete(url, headers=headers)
+        with span("discord.delete_message", "http", channel_id=channel_id) as trace_args:
+            response = session.delete(url, headers=headers)
+            trace_args["status"] = response.status_code
         if response.status_code == 204:
             log_message(queue, f"[{channel_id}] Pesan {message_id} dihapus.", "SUCCESS")
         else:
@@ -329,8 +346,26 @@ def delete_message(channel_id, message_id, token, queue):
         log_message(queue, f"[{channel_id}] Error hapus pesan: {e}", "ERROR")
 
 
-def auto_reply(channel_id, settings, token, google_api_keys, queue, stop_event, agentrouter_api_keys=None):
+def refresh_task_settings(task_id, applied_version):
+    """Return (version, settings, keys) if a newer snapshot exists for the task, else None."""
+    version, latest, keys = get_task_settings(task_id)
+    if latest is None or version == applied_version:
+        return None
+    return version, latest, keys
+
+
+def auto_reply(channel_id, settings, token, google_api_keys, queue, stop_event, agentrouter_api_keys=None, task_id=None):
+    try:
+        _auto_reply_loop(channel_id, settings, token, google_api_keys, queue, stop_event, agentrouter_api_keys, task_id)
+    finally:
+        # Cleared by the task thread itself so a late mark_applied can't outlive it
+        if task_id is not None:
+            clear_applied(task_id, owner=stop_event)
+
+
+def _auto_reply_loop(channel_id, settings, token, google_api_keys, queue, stop_event, agentrouter_api_keys, task_id):
     headers = {"Authorization": token}
+    applied_version = None
 
     username, _, bot_user_id = get_bot_info(token, queue)
     if bot_user_id == "UnknownID":
@@ -342,6 +377,17 @@ def auto_reply(channel_id, settings, token, google_api_keys, queue, stop_event,
     log_message(queue, f"[{channel_id}] Bot started as {username} in {mode} mode", "SUCCESS")
 
     while not stop_event.is_set():
+        # Pick up settings saved via /save_config at the cycle boundary
+        if task_id is not None and (update := refresh_task_settings(task_id, applied_version)):
+            version, latest, keys = update
+            if applied_version is not None and latest != settings:
+                log_message(queue, f"[{channel_id}] Pengaturan diperbarui (v{version})", "INFO")
+            settings = latest
+            google_api_keys = keys["google_api_keys"]
+            agentrouter_api_keys = keys["agentrouter_api_keys"]
+            applied_version = version
+            mark_applied(task_id, version, owner=stop_event)
+
         try:
             # Determine mode with backward compatibility
             mode = settings.get("mode") or ("gemini" if settings.get("use_google_ai") else "pesan")
@@ -349,10 +395,12 @@ def auto_reply(channel_id, settings, token, google_api_keys, queue, stop_event,
                 if stop_event.wait(timeout=settings.get("read_delay", 10)):
                     break
 
-                response = session.get(
-                    f"https://discord.com/api/v9/channels/{channel_id}/messages?limit=1",
-                    headers=headers,
-                )
+                with span("discord.poll_messages", "http", channel_id=channel_id) as trace_args:
+                    response = session.get(
+                        f"https://discord.com/api/v9/channels/{channel_id}/messages?limit=1",
+                        headers=headers,
+                    )
+                    trace_args["status"] = response.status_code
                 response.raise_for_status()
                 messages = response.json()
 
@@ -384,50 +432,55 @@ def auto_reply(channel_id, settings, token, google_api_keys, queue, stop_event,
                                 else:
                                     agentrouter_key = random.choice([k for k in agentrouter_api_keys if k])
                                     model_id = settings.get("agentrouter_model", "gpt-5")
-                                    reply_text = generate_reply_agentrouter(
+                                    with span("auto_reply.generate", "stage", mode=mode):
+                                        reply_text = generate_reply_agentrouter(
+                                            user_message,
+                                            settings.get("prompt_language"),
+                                            agentrouter_key,
+                                            model_id,
+                                            queue,
+                                        )
+                            else:  # gemini mode
+                                with span("auto_reply.generate", "stage", mode=mode):
+                                    reply_text = generate_reply(
                                         user_message,
                                         settings.get("prompt_language"),
-                                        agentrouter_key,
-                                        model_id,
+                                        True,
+                                        google_api_keys,
                                         queue,
                                     )
-                            else:  # gemini mode
-                                reply_text = generate_reply(
-                                    user_message,
-                                    settings.get("prompt_language"),
-                                    True,
-                                    google_api_keys,
-                                    queue,
-                                )
 
                             if reply_text:
-                                send_message(
-                                    channel_id,
-                                    reply_text,
-                                    token,
-                                    queue,
-                                    reply_to=(
-                                        message_id
-                                        if settings.get("use_reply")
-                                        else None
-                                    ),
-                                    delete_after=settings.get("delete_bot_reply"),
-                                    delete_immediately=settings.get(
-                                        "delete_immediately"
-                                    ),
-                                )
+                                with span("auto_reply.send", "stage", mode=mode):
+                                    send_message(
+                                        channel_id,
+                                        reply_text,
+                                        token,
+                                        queue,
+                                        reply_to=(
+                                            message_id
+                                            if settings.get("use_reply")
+                                            else None
+                                        ),
+                                        delete_after=settings.get("delete_bot_reply"),
+                                        delete_immediately=settings.get(
+                                            "delete_immediately"
+                                        ),
+                                    )
             else:
                 if stop_event.wait(timeout=settings.get("delay_interval", 30)):
                     break
-                message_text = generate_reply("", "", False, [], queue)
-                send_message(
-                    channel_id,
-                    message_text,
-                    token,
-                    queue,
-                    delete_after=settings.get("delete_bot_reply"),
-                    delete_immediately=settings.get("delete_immediately"),
-                )
+                with span("auto_reply.generate", "stage", mode=mode):
+                    message_text = generate_reply("", "", False, [], queue)
+                with span("auto_reply.send", "stage", mode=mode):
+                    send_message(
+                        channel_id,
+                        message_text,
+                        token,
+                        queue,
+                        delete_after=settings.get("delete_bot_reply"),
+                        delete_immediately=settings.get("delete_immediately"),
+                    )
 
             if stop_event.wait(timeout=settings.get("delay_interval", 30)):
                 break
@@ -447,20 +500,22 @@ def auto_reply(channel_id, settings, token, google_api_keys, queue, stop_event,
 def get_channel_info(channel_id, token, queue):
     headers = {"Authorization": token}
     try:
-        res = session.get(
-            f"https://discord.com/api/v9/channels/{channel_id}",
-            headers=headers,
-            timeout=10,
-        )
+        with span("discord.get_channel", "http", channel_id=channel_id):
+            res = session.get(
+                f"https://discord.com/api/v9/channels/{channel_id}",
+                headers=headers,
+                timeout=10,
+            )
         res.raise_for_status()
         data = res.json()
         server_name = "Direct Message"
         if guild_id := data.get("guild_id"):
-            guild_res = session.get(
-                f"https://discord.com/api/v9/guilds/{guild_id}",
-                headers=headers,
-                timeout=10,
-            )
+            with span("discord.get_guild", "http", guild_id=guild_id):
+                guild_res = session.get(
+                    f"https://discord.com/api/v9/guilds/{guild_id}",
+                    headers=headers,
+                    timeout=10,
+                )
             guild_res.raise_for_status()
             server_name = guild_res.json().get("name", "Unknown Server")
         return server_name, data.get("name", "Unknown Channel")
@@ -481,9 +536,10 @@ def get_bot_info(token, queue):
 
     headers = {"Authorization": token}
     try:
-        res = session.get(
-            "https://discord.com/api/v9/users/@me", headers=headers, timeout=10
-        )
+        with span("discord.get_bot_info", "http"):
+            res = session.get(
+                "https://discord.com/api/v9/users/@me", headers=headers, timeout=10
+            )
 
         # Handle specific error codes
         if res.status_code == 401:
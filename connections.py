@@ -0,0 +1,167 @@
+import threading
+from collections import Counter
+from requests.adapters import HTTPAdapter
+from urllib3 import PoolManager
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Upstream hosts grouped by service, with connections needed per running task:
+# Discord handles polling, sending and delayed deletes; AI hosts one call per reply.
+HOST_GROUPS = {
+    "discord.com": ("discord", 2),
+    "generativelanguage.googleapis.com": ("gemini", 1),
+    "agentrouter.org": ("agentrouter", 1),
+}
+DEFAULT_GROUP = ("other", 1)
+MIN_POOL_SIZE = 4
+
+_stats = {}
+_stats_lock = threading.Lock()
+_pool_sizes = {}
+
+
+def _host_group(host):
+    return HOST_GROUPS.get(host, DEFAULT_GROUP)
+
+
+def _count(host, key):
+    with _stats_lock:
+        _stats.setdefault(host, Counter())[key] += 1
+
+
+def compute_pool_size(host, active_tasks, workers):
+    _, per_task = _host_group(host)
+    return max(MIN_POOL_SIZE, active_tasks * per_task + workers)
+
+
+class _InstrumentedPoolMixin:
+    """Connection pool that counts handshakes, reuse and exhaustion, and can be resized in place."""
+
+    def _get_conn(self, timeout=None):
+        # All connections busy: urllib3 opens an extra one right away, we only count it
+        if self.pool is not None and self.pool.empty():
+            _count(self.host, "pool_exhausted")
+        return super()._get_conn(timeout=timeout)
+
+    def _put_conn(self, conn):
+        if self.pool is not None and self.pool.full():
+            _count(self.host, "discarded_connections")
+        super()._put_conn(conn)
+
+    def _validate_conn(self, conn):
+        _count(self.host, "new_connections" if conn.sock is None else "reused_connections")
+        super()._validate_conn(conn)
+
+    def resize(self, maxsize):
+        """Grow or shrink the pool without giving up idle keep-alive connections."""
+        pool = self.pool
+        if pool is None or maxsize == pool.maxsize:
+            return
+        dropped = []
+        with pool.mutex:
+            grow = maxsize - pool.maxsize
+            pool.maxsize = maxsize
+            if grow > 0:
+                # LifoQueue hands out from the end: put placeholders at the front,
+                # like urllib3 fills a new pool, so idle connections stay on top
+                pool.queue[0:0] = [None] * grow
+                pool.not_empty.notify(grow)
+            else:
+                # Drop placeholders first, then the least recently used connections
+                extra = len(pool.queue) - maxsize
+                while extra > 0 and None in pool.queue:
+                    pool.queue.remove(None)
+                    extra -= 1
+                while len(pool.queue) > maxsize:
+                    dropped.append(pool.queue.pop(0))
+        for conn in dropped:
+            conn.close()
+
+
+class InstrumentedHTTPConnectionPool(_InstrumentedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class InstrumentedHTTPSConnectionPool(_InstrumentedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class HostPoolManager(PoolManager):
+    """PoolManager with one instrumented pool per upstream host, each sized separately."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_classes_by_scheme = {
+            "http": InstrumentedHTTPConnectionPool,
+            "https": InstrumentedHTTPSConnectionPool,
+        }
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        request_context = dict(request_context or self.connection_pool_kw)
+        request_context["maxsize"] = _pool_sizes.get(host, request_context.get("maxsize", MIN_POOL_SIZE))
+        return super()._new_pool(scheme, host, port, request_context)
+
+    def resize_pools(self):
+        with self.pools.lock:
+            pools = [self.pools[key] for key in self.pools.keys()]
+        for pool in pools:
+            if pool.host in _pool_sizes:
+                pool.resize(_pool_sizes[pool.host])
+
+
+class HostPoolAdapter(HTTPAdapter):
+    """HTTPAdapter backed by HostPoolManager."""
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = HostPoolManager(
+            num_pools=connections, maxsize=maxsize, block=block, **pool_kwargs
+        )
+
+
+def configure_pools(adapter, active_tasks, workers):
+    """Resize per-host pools for the current number of running tasks and workers."""
+    for host in HOST_GROUPS:
+        _pool_sizes[host] = compute_pool_size(host, active_tasks, workers)
+    adapter.poolmanager.resize_pools()
+    return dict(_pool_sizes)
+
+
+def merge_connection_stats(stats_list):
+    """Sum per-host stats reported by several processes."""
+    counters = ("new_connections", "reused_connections", "pool_exhausted", "discarded_connections")
+    merged = {}
+    for stats in stats_list:
+        for host, host_stats in stats.items():
+            entry = merged.setdefault(host, {"group": host_stats["group"], "pool_size": None,
+                                             **{key: 0 for key in counters}})
+            if host_stats.get("pool_size") is not None:
+                entry["pool_size"] = (entry["pool_size"] or 0) + host_stats["pool_size"]
+            for key in counters:
+                entry[key] += host_stats.get(key, 0)
+    for entry in merged.values():
+        total = entry["new_connections"] + entry["reused_connections"]
+        entry["reuse_ratio"] = round(entry["reused_connections"] / total, 3) if total else None
+    return merged
+
+
+def get_connection_stats():
+    """Return per-host connection counters and current pool sizes."""
+    with _stats_lock:
+        stats = {host: dict(counter) for host, counter in _stats.items()}
+    hosts = {}
+    for host in set(stats) | set(_pool_sizes):
+        counters = stats.get(host, {})
+        new = counters.get("new_connections", 0)
+        reused = counters.get("reused_connections", 0)
+        hosts[host] = {
+            "group": _host_group(host)[0],
+            "pool_size": _pool_sizes.get(host),
+            "new_connections": new,
+            "reused_connections": reused,
+            "pool_exhausted": counters.get("pool_exhausted", 0),
+            "discarded_connections": counters.get("discarded_connections", 0),
+            "reuse_ratio": round(reused / (new + reused), 3) if new + reused else None,
+        }
+    return hosts
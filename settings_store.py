@@ -0,0 +1,72 @@
+import threading
+from types import MappingProxyType
+
+# Current snapshot as a single (version, tasks, keys) tuple so readers always
+# see a consistent view; rebinding a module global is atomic.
+_snapshot = (0, MappingProxyType({}), MappingProxyType({}))
+_publish_lock = threading.Lock()
+_applied_versions = {}
+
+
+def _freeze_config(config):
+    tasks = MappingProxyType({
+        task.get("id"): MappingProxyType(dict(task))
+        for task in config.get("tasks", [])
+        if task.get("id")
+    })
+    keys = MappingProxyType({
+        "google_api_keys": tuple(config.get("google_api_keys", [])),
+        "agentrouter_api_keys": tuple(config.get("agentrouter_api_keys", [])),
+    })
+    return tasks, keys
+
+
+def publish(config, version=None):
+    """Swap in a new immutable settings snapshot built from `config`.
+
+    The version is only bumped when task settings or API keys actually
+    changed. Worker processes pass the coordinator's `version` so versions
+    match across processes. Returns the current version.
+    """
+    global _snapshot
+    tasks, keys = _freeze_config(config)
+    with _publish_lock:
+        current, current_tasks, current_keys = _snapshot
+        if version is None:
+            if tasks == current_tasks and keys == current_keys:
+                return current
+            version = current + 1
+        elif version == current:
+            return current
+        _snapshot = (version, tasks, keys)
+        return version
+
+
+def get_version():
+    return _snapshot[0]
+
+
+def get_task_settings(task_id):
+    """Return (version, task settings, api keys) from the current snapshot.
+
+    Settings are None if the task is no longer in the config.
+    """
+    version, tasks, keys = _snapshot
+    return version, tasks.get(task_id), keys
+
+
+def mark_applied(task_id, version, owner=None):
+    _applied_versions[task_id] = (owner, version)
+
+
+def get_applied_version(task_id):
+    entry = _applied_versions.get(task_id)
+    return entry[1] if entry else None
+
+
+def clear_applied(task_id, owner=None):
+    """Drop the task's applied version, unless a newer run of the task owns it."""
+    with _publish_lock:
+        entry = _applied_versions.get(task_id)
+        if entry and entry[0] is owner:
+            del _applied_versions[task_id]
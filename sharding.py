@@ -0,0 +1,461 @@
+import bisect
+import hashlib
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import wait
+from queue import Empty
+from connections import merge_connection_stats
+
+VIRTUAL_NODES = 64  # Ring points per worker, smooths task distribution
+STATUS_INTERVAL = 2  # Seconds between worker status reports
+MONITOR_INTERVAL = 2  # Seconds between worker liveness checks
+MAX_RESTARTS = 3  # Crashes allowed within RESTART_WINDOW before a worker is dropped
+RESTART_WINDOW = 60
+MAX_EVENTS = 100
+REPLY_TIMEOUT = 5  # Seconds to wait for workers to answer trace/profile requests
+
+
+class HashRing:
+    """Consistent hash ring mapping channel IDs to worker IDs."""
+
+    def __init__(self, nodes=(), replicas=VIRTUAL_NODES):
+        self.replicas = replicas
+        self._keys = []
+        self._ring = {}
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(str(key).encode("utf-8")).hexdigest()[:16], 16)
+
+    def add(self, node):
+        for i in range(self.replicas):
+            point = self._hash(f"{node}:{i}")
+            self._ring[point] = node
+            bisect.insort(self._keys, point)
+
+    def remove(self, node):
+        for i in range(self.replicas):
+            point = self._hash(f"{node}:{i}")
+            if self._ring.pop(point, None) is not None:
+                self._keys.remove(point)
+
+    def get(self, key):
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._ring[self._keys[index]]
+
+
+class _RelayQueue:
+    """Queue-like object that forwards log lines from a worker to the coordinator."""
+
+    def __init__(self, send_event):
+        self.send_event = send_event
+
+    def put(self, message):
+        self.send_event("log", message)
+
+
+def worker_main(worker_id, command_queue, event_conn):
+    """Entry point of a worker process: runs auto_reply threads for its shard."""
+    # Shutdown is driven by the coordinator, not by the terminal's Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    import settings_store
+    from bot_logic import auto_reply, resize_connection_pools
+    from connections import get_connection_stats
+    from tracing import get_trace, profile_thread
+
+    parent = multiprocessing.parent_process()
+    send_lock = threading.Lock()
+    threads = {}
+    last_report = 0
+
+    def send_event(kind, payload):
+        # Task, timer and main threads all write to the same pipe
+        with send_lock:
+            try:
+                event_conn.send((kind, worker_id, payload))
+            except (BrokenPipeError, OSError):
+                pass
+
+    relay = _RelayQueue(send_event)
+
+    def update_connection_pools():
+        current = threading.current_thread()
+        running = sum(1 for thread in list(threads.values())
+                      if thread.is_alive() and thread is not current)
+        resize_connection_pools(running, 0)
+
+    def profile_and_reply(request_id, thread_ident, seconds):
+        send_event("reply", {"request_id": request_id, "result": profile_thread(thread_ident, seconds)})
+
+    def run_task(*args):
+        # Give the pool share back when the task exits on its own
+        try:
+            auto_reply(*args)
+        finally:
+            update_connection_pools()
+
+    def report_status():
+        send_event("status", {
+            "pid": os.getpid(),
+            "tasks": {
+                task_id: {
+                    "alive": thread.is_alive(),
+                    "settings_version": settings_store.get_applied_version(task_id),
+                }
+                for task_id, thread in threads.items()
+            },
+            "connections": get_connection_stats(),
+        })
+
+    while True:
+        # Panel is gone: stop our tasks so a restarted panel doesn't run duplicates
+        if parent is not None and not parent.is_alive():
+            break
+
+        try:
+            command = command_queue.get(timeout=STATUS_INTERVAL)
+        except Empty:
+            command = None
+
+        if command is not None:
+            op = command.get("op")
+            if op == "shutdown":
+                break
+            elif op == "config":
+                settings_store.publish(command["config"], version=command["version"])
+            elif op == "start":
+                task_id = command["task_id"]
+                if task_id not in threads or not threads[task_id].is_alive():
+                    stop_event = threading.Event()
+                    thread = threading.Thread(target=run_task, args=(
+                        command["channel_id"], command["settings"], command["token"],
+                        command["google_api_keys"], relay, stop_event,
+                        command["agentrouter_api_keys"], task_id),
+                        name=f"task-{task_id}", daemon=True)
+                    thread.stop_event = stop_event
+                    threads[task_id] = thread
+                    thread.start()
+            elif op == "stop":
+                thread = threads.pop(command["task_id"], None)
+                if thread is not None:
+                    thread.stop_event.set()
+            elif op == "trace":
+                send_event("reply", {
+                    "request_id": command["request_id"],
+                    "result": get_trace(clear=command.get("clear", False),
+                                        process_name=f"worker-{worker_id}"),
+                })
+            elif op == "profile":
+                thread = threads.get(command["task_id"])
+                if thread is None or not thread.is_alive():
+                    send_event("reply", {"request_id": command["request_id"], "result": None})
+                else:
+                    # Sample in the background so the command loop keeps serving
+                    threading.Thread(target=profile_and_reply, args=(
+                        command["request_id"], thread.ident, command["seconds"]),
+                        name="profiler", daemon=True).start()
+
+            if op in ("start", "stop"):
+                update_connection_pools()
+
+        if command is not None or time.monotonic() - last_report >= STATUS_INTERVAL:
+            report_status()
+            last_report = time.monotonic()
+
+    for thread in threads.values():
+        thread.stop_event.set()
+
+
+def _strip_pool_sizes(stats):
+    return {host: {**host_stats, "pool_size": None} for host, host_stats in stats.items()}
+
+
+class ShardCoordinator:
+    """Assigns tasks to worker processes by channel ID and supervises them."""
+
+    def __init__(self, num_workers, log_queue):
+        self.num_workers = num_workers
+        self.log_queue = log_queue
+        self.ctx = multiprocessing.get_context("spawn")
+        self.ring = HashRing(range(num_workers))
+        self.workers = {}
+        self.tasks = {}  # task_id -> start command incl. assigned worker
+        self.task_status = {}
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.config = None
+        self.config_version = None
+        self.lock = threading.RLock()
+        self.stopping = threading.Event()
+        self._stale_event_conns = []
+        self._request_seq = 0
+        self._replies = {}
+        self._reply_ready = threading.Condition(self.lock)
+
+    def start(self):
+        for worker_id in range(self.num_workers):
+            self._spawn(worker_id)
+        threading.Thread(target=self._relay_events, name="shard-relay", daemon=True).start()
+        threading.Thread(target=self._monitor, name="shard-monitor", daemon=True).start()
+        self._event(f"{self.num_workers} worker process dimulai")
+
+    def _event(self, message):
+        self.events.append({"time": time.time(), "message": message})
+        self.log_queue.put(f"🧩 {message}")
+
+    def _spawn(self, worker_id):
+        # Each worker gets its own event pipe, so one killed mid-write can't
+        # block relaying for the others
+        command_queue = self.ctx.Queue()
+        event_reader, event_writer = self.ctx.Pipe(duplex=False)
+        process = self.ctx.Process(
+            target=worker_main, args=(worker_id, command_queue, event_writer),
+            name=f"worker-{worker_id}", daemon=True)
+        process.start()
+        event_writer.close()
+        previous = self.workers.get(worker_id, {})
+        if previous.get("events") is not None:
+            self._stale_event_conns.append(previous["events"])
+        self.workers[worker_id] = {
+            "process": process,
+            "commands": command_queue,
+            "events": event_reader,
+            "connections": {},
+            # Counters of previous runs, so totals don't drop after a restart
+            "connections_base": _strip_pool_sizes(merge_connection_stats([
+                previous.get("connections_base", {}), previous.get("connections", {})])),
+            "restarts": previous.get("restarts", 0),
+            "crashes": previous.get("crashes", []),
+            "failed": False,
+        }
+        if self.config is not None:
+            command_queue.put({"op": "config", "config": self.config, "version": self.config_version})
+
+    def _send(self, worker_id, command):
+        worker = self.workers.get(worker_id)
+        if worker and not worker["failed"]:
+            worker["commands"].put(command)
+
+    def publish_config(self, config, version):
+        """Forward a settings snapshot to all workers for hot settings propagation."""
+        with self.lock:
+            if version == self.config_version:
+                return
+            self.config = config
+            self.config_version = version
+            for worker_id in self.workers:
+                self._send(worker_id, {"op": "config", "config": config, "version": version})
+
+    def start_task(self, task_id, channel_id, settings, token, google_api_keys, agentrouter_api_keys):
+        with self.lock:
+            worker_id = self.ring.get(channel_id)
+            if worker_id is None:
+                return None
+            command = {
+                "op": "start", "task_id": task_id, "channel_id": channel_id,
+                "settings": dict(settings), "token": token,
+                "google_api_keys": list(google_api_keys),
+                "agentrouter_api_keys": list(agentrouter_api_keys),
+            }
+            self.tasks[task_id] = {"worker": worker_id, "command": command}
+            self.task_status.pop(task_id, None)
+            self._send(worker_id, command)
+            return worker_id
+
+    def stop_task(self, task_id):
+        with self.lock:
+            task = self.tasks.pop(task_id, None)
+            self.task_status.pop(task_id, None)
+            if task is None:
+                return False
+            self._send(task["worker"], {"op": "stop", "task_id": task_id})
+            return True
+
+    def is_running(self, task_id):
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return False
+            worker = self.workers[task["worker"]]
+            status = self.task_status.get(task_id, {})
+            return worker["process"].is_alive() and status.get("alive", True)
+
+    def get_worker(self, task_id):
+        task = self.tasks.get(task_id)
+        return task["worker"] if task else None
+
+    def get_settings_version(self, task_id):
+        return self.task_status.get(task_id, {}).get("settings_version")
+
+    def get_overview(self):
+        """Worker placement, load and recent rebalance events for the dashboard."""
+        with self.lock:
+            workers = []
+            for worker_id, worker in sorted(self.workers.items()):
+                assigned = sorted(task_id for task_id, task in self.tasks.items()
+                                  if task["worker"] == worker_id)
+                workers.append({
+                    "id": worker_id,
+                    "pid": worker["process"].pid,
+                    "alive": worker["process"].is_alive(),
+                    "failed": worker["failed"],
+                    "restarts": worker["restarts"],
+                    "tasks": assigned,
+                })
+            return {
+                "workers": workers,
+                "placement": {task_id: task["worker"] for task_id, task in self.tasks.items()},
+                "events": list(self.events)[::-1],
+            }
+
+    def get_connection_stats(self):
+        """Per-host connection stats of each worker, including runs before a restart."""
+        with self.lock:
+            return [merge_connection_stats([worker["connections_base"], worker["connections"]])
+                    for worker in self.workers.values()]
+
+    def _request(self, worker_ids, command, timeout):
+        """Send a request op to workers and wait for their replies (worker_id -> result)."""
+        with self._reply_ready:
+            self._request_seq += 1
+            request_id = self._request_seq
+            expected = {worker_id for worker_id in worker_ids
+                        if not self.workers[worker_id]["failed"]
+                        and self.workers[worker_id]["process"].is_alive()}
+            self._replies[request_id] = {}
+            for worker_id in expected:
+                self._send(worker_id, {**command, "request_id": request_id})
+
+            deadline = time.monotonic() + timeout
+            while not expected <= set(self._replies[request_id]):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._reply_ready.wait(remaining)
+            return self._replies.pop(request_id)
+
+    def collect_traces(self, clear=False, timeout=REPLY_TIMEOUT):
+        """Ask every live worker for its trace buffer and wait for the replies."""
+        replies = self._request(list(self.workers), {"op": "trace", "clear": clear}, timeout)
+        return list(replies.values())
+
+    def profile_task(self, task_id, seconds):
+        """Profile a task in the worker that owns it; None if it isn't running."""
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return None
+            worker_id = task["worker"]
+        replies = self._request([worker_id], {"op": "profile", "task_id": task_id, "seconds": seconds},
+                                seconds + REPLY_TIMEOUT)
+        return replies.get(worker_id)
+
+    def _drop_event_conn(self, worker_id, conn):
+        with self.lock:
+            worker = self.workers.get(worker_id)
+            if worker and worker["events"] is conn:
+                worker["events"] = None
+        conn.close()
+
+    def _relay_events(self):
+        while not self.stopping.is_set():
+            with self.lock:
+                stale, self._stale_event_conns = self._stale_event_conns, []
+                readers = {worker["events"]: worker_id for worker_id, worker in self.workers.items()
+                           if worker["events"] is not None}
+            for conn in stale:
+                if conn not in readers:
+                    conn.close()
+            if not readers:
+                self.stopping.wait(1)
+                continue
+
+            for conn in wait(list(readers), timeout=1):
+                try:
+                    kind, worker_id, payload = conn.recv()
+                except Exception:
+                    # Worker exited (possibly mid-write): drop only its pipe,
+                    # the monitor restarts it with a fresh one
+                    self._drop_event_conn(readers[conn], conn)
+                    continue
+                self._handle_event(kind, worker_id, payload)
+
+    def _handle_event(self, kind, worker_id, payload):
+        if kind == "log":
+            self.log_queue.put(f"[W{worker_id}] {payload}")
+        elif kind == "status":
+            with self.lock:
+                self.workers[worker_id]["connections"] = payload.get("connections", {})
+                for task_id, status in payload["tasks"].items():
+                    task = self.tasks.get(task_id)
+                    if task and task["worker"] == worker_id:
+                        self.task_status[task_id] = status
+        elif kind == "reply":
+            with self._reply_ready:
+                replies = self._replies.get(payload["request_id"])
+                if replies is not None:
+                    replies[worker_id] = payload["result"]
+                    self._reply_ready.notify_all()
+
+    def _monitor(self):
+        while not self.stopping.wait(MONITOR_INTERVAL):
+            with self.lock:
+                for worker_id, worker in list(self.workers.items()):
+                    if worker["failed"] or worker["process"].is_alive():
+                        continue
+                    self._handle_crash(worker_id, worker)
+
+    def _handle_crash(self, worker_id, worker):
+        now = time.time()
+        worker["crashes"] = [t for t in worker["crashes"] if now - t < RESTART_WINDOW] + [now]
+        orphaned = []
+        for task_id, task in list(self.tasks.items()):
+            if task["worker"] != worker_id:
+                continue
+            status = self.task_status.pop(task_id, None)
+            if status is not None and not status.get("alive", True):
+                # Already exited on its own before the crash: leave it stopped
+                del self.tasks[task_id]
+                continue
+            orphaned.append(task_id)
+
+        if len(worker["crashes"]) <= MAX_RESTARTS:
+            worker["restarts"] += 1
+            self._event(f"Worker {worker_id} crash (exit {worker['process'].exitcode}), restart ke-{worker['restarts']}")
+            self._spawn(worker_id)
+            for task_id in orphaned:
+                self._send(worker_id, self.tasks[task_id]["command"])
+            return
+
+        # Crashing repeatedly: take it off the ring and move only its tasks
+        worker["failed"] = True
+        self.ring.remove(worker_id)
+        self._event(f"Worker {worker_id} terlalu sering crash, dikeluarkan dari ring")
+        for task_id in orphaned:
+            task = self.tasks[task_id]
+            new_worker = self.ring.get(task["command"]["channel_id"])
+            if new_worker is None:
+                del self.tasks[task_id]
+                self._event(f"Tugas '{task_id}' dihentikan: tidak ada worker tersisa")
+                continue
+            task["worker"] = new_worker
+            self._send(new_worker, task["command"])
+            self._event(f"Rebalance: tugas '{task_id}' dipindah W{worker_id} → W{new_worker}")
+
+    def shutdown(self):
+        self.stopping.set()
+        with self.lock:
+            for worker_id in self.workers:
+                self._send(worker_id, {"op": "shutdown"})
+            for worker in self.workers.values():
+                worker["process"].join(timeout=2)
+                if worker["process"].is_alive():
+                    worker["process"].terminate()
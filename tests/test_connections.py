@@ -0,0 +1,113 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from connections import HostPoolAdapter, get_connection_stats
+
+HOST = "127.0.0.1"
+
+
+class _OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so connections can be reused
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer((HOST, 0), _OkHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://{HOST}:{httpd.server_port}/"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def session():
+    session = requests.Session()
+    adapter = HostPoolAdapter(pool_maxsize=4)
+    session.mount("http://", adapter)
+    yield session, adapter
+    session.close()
+
+
+def _counters():
+    stats = get_connection_stats().get(HOST, {})
+    return stats.get("new_connections", 0), stats.get("reused_connections", 0)
+
+
+def _pool(adapter):
+    # The pool requests created for the test server (key includes requests' pool kwargs)
+    pools = adapter.poolmanager.pools
+    (key,) = pools.keys()
+    return pools[key]
+
+
+def test_grow_keeps_idle_connection_on_top(server, session):
+    session, adapter = session
+    session.get(server)
+    new_before, reused_before = _counters()
+
+    _pool(adapter).resize(10)
+    session.get(server)
+
+    new_after, reused_after = _counters()
+    assert (new_after - new_before, reused_after - reused_before) == (0, 1)
+
+
+def test_shrink_drops_placeholders_before_connections(server, session):
+    session, adapter = session
+    session.get(server)
+    pool = _pool(adapter)
+
+    pool.resize(25)
+    pool.resize(4)
+
+    assert len(pool.pool.queue) == 4
+    assert pool.pool.queue[:3] == [None, None, None]
+    assert pool.pool.queue[-1] is not None
+
+    new_before, reused_before = _counters()
+    session.get(server)
+    new_after, reused_after = _counters()
+    assert (new_after - new_before, reused_after - reused_before) == (0, 1)
+
+
+def test_shrink_closes_least_recently_used_connections(server, session):
+    session, adapter = session
+    session.get(server)
+    pool = _pool(adapter)
+    conns = [pool._get_conn() for _ in range(4)]
+    for conn in conns:
+        conn.connect()
+        pool._put_conn(conn)
+
+    pool.resize(2)
+
+    assert pool.pool.queue == conns[2:]
+    assert all(conn.sock is None for conn in conns[:2])
+
+
+def test_exhausted_pool_opens_connection_without_waiting(server, session):
+    session, adapter = session
+    session.get(server)
+    pool = _pool(adapter)
+    pool.resize(1)
+    pool._get_conn()
+
+    exhausted_before = get_connection_stats()[HOST].get("pool_exhausted", 0)
+    started = time.monotonic()
+    conn = pool._get_conn()
+    assert time.monotonic() - started < 0.5
+    assert conn is not None
+    assert get_connection_stats()[HOST]["pool_exhausted"] == exhausted_before + 1
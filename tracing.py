@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import threading
+from collections import deque, Counter
+from contextlib import contextmanager
+
+MAX_SPANS = 10000  # Bounded buffer, oldest spans are dropped first
+MAX_PROFILE_SECONDS = 60
+PROFILE_INTERVAL = 0.005  # 5 ms sampling interval
+
+_spans = deque(maxlen=MAX_SPANS)
+_thread_names = {}
+
+
+@contextmanager
+def span(name, category="bot", **args):
+    """Record a timed span into the in-memory trace buffer.
+
+    Yields the args dict so callers can attach details (e.g. status code)
+    while the span is open.
+    """
+    thread = threading.current_thread()
+    _thread_names[thread.ident] = thread.name
+    start = time.perf_counter_ns()
+    try:
+        yield args
+    finally:
+        end = time.perf_counter_ns()
+        _spans.append({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start // 1000,
+            "dur": (end - start) // 1000,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": args,
+        })
+
+
+def get_trace(clear=False, process_name="discord-panel"):
+    """Export recorded spans as Chrome/Perfetto trace JSON (dict)."""
+    events = list(_spans)
+    if clear:
+        _spans.clear()
+
+    pid = os.getpid()
+    metadata = [{
+        "name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+        "args": {"name": process_name},
+    }]
+    for tid in {event["tid"] for event in events}:
+        metadata.append({
+            "name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+            "args": {"name": _thread_names.get(tid, str(tid))},
+        })
+
+    return {"traceEvents": metadata + events, "displayTimeUnit": "ms"}
+
+
+def merge_traces(traces):
+    """Combine traces from several processes into one trace JSON (dict)."""
+    events = []
+    for trace in traces:
+        events.extend(trace.get("traceEvents", []))
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def _collapse_frame(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def profile_thread(thread_ident, seconds, interval=PROFILE_INTERVAL):
+    """Sample a running thread's stack for `seconds` and return collapsed stacks.
+
+    Output is one "frame;frame;frame count" line per unique stack, ready for
+    flamegraph.pl / speedscope. Stops early if the thread exits.
+    """
+    seconds = max(0.1, min(float(seconds), MAX_PROFILE_SECONDS))
+    counts = Counter()
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_ident)
+        if frame is None:
+            break
+        counts[_collapse_frame(frame)] += 1
+        del frame
+        time.sleep(interval)
+
+    return "\n".join(f"{stack} {count}" for stack, count in counts.most_common()) + "\n"